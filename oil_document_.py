@@ -1,31 +1,273 @@
 
 import os
 import json
+import asyncio
 import re
 import logging
+import multiprocessing
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import fitz
+import httpx
+import numpy as np
 import ollama
+import orjson
 import pytesseract
-from PIL import Image
-from time import sleep
 from tqdm import tqdm
-from typing import List, Dict
-from pdf2image import convert_from_path
+from typing import List, Dict, Optional, Tuple
+
+# PSM 4 (single column of variable-size text) copes better with the invoices' column layouts than PSM 6.
+OCR_CONFIG = "--psm 4 --oem 3 -l eng"
+# Pages are OCR'd at the processor's dpi (200 by default); ones yielding less than
+# MIN_PAGE_TEXT_CHARS are retried once at OCR_RETRY_DPI.
+OCR_RETRY_DPI = 300
+MIN_PAGE_TEXT_CHARS = 50
+# Threads each tesseract process may use; workers are sized as cpu_count // this.
+TESSERACT_THREAD_LIMIT = 1
+
+# Rendered pages whose pixel standard deviation is below this are treated as blank and not OCR'd.
+BLANK_PAGE_STDDEV = 3.0
+
+# Must be set before libtesseract is loaded in-process; tesseract subprocesses inherit it too.
+os.environ.setdefault("OMP_THREAD_LIMIT", str(TESSERACT_THREAD_LIMIT))
+try:
+    from tesserocr import PyTessBaseAPI, PSM, OEM
+except ImportError:  # tesserocr is optional; fall back to batched tesseract CLI calls
+    PyTessBaseAPI = None
+
+
+LLM_BACKENDS = ("ollama", "llamacpp")
+DEFAULT_OLLAMA_MODEL = "phi3:3.8b-mini-4k-instruct-q4_K_M"
+# The extraction JSON is short, so cap generation; num_ctx covers phi3-mini's full 4k window.
+OLLAMA_OPTIONS = {"num_batch": 256, "num_ctx": 4096, "num_predict": 256}
+
+EXTRACTION_FIELDS = (
+    "document_type", "invoice_number", "issue_date", "due_date", "buyer", "seller",
+    "total_amount_usd", "vessel_name", "bbl_quantity", "bl_date", "port_of_loading",
+    "port_of_discharge", "suggested_filename",
+)
+
+
+def _results_grammar(fields) -> str:
+    # GBNF for llama.cpp: {"results": [...]} whose entries carry an integer id and exactly these string fields.
+    members = "".join(f' "," ws "\\"{field}\\"" ws ":" ws string' for field in fields)
+    return "\n".join([
+        r'root ::= "{" ws "\"results\"" ws ":" ws "[" ws result ( ws "," ws result )* ws "]" ws "}"',
+        f'result ::= "{{" ws "\\"id\\"" ws ":" ws [0-9]+{members} ws "}}"',
+        r'string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F]{4}) )* "\""',
+        r'ws ::= [ \t\n]{0,20}',
+    ])
+
+
+EXTRACTION_GRAMMAR = _results_grammar(EXTRACTION_FIELDS)
+_JSON_DECODER = json.JSONDecoder()
+
+# Prompt budget for OCR text: the header (invoice number, dates, parties) plus the totals block.
+PROMPT_HEAD_CHARS = 2000
+PROMPT_TAIL_CHARS = 1000
+
+
+def _compact_text(text: str, max_chars: int = PROMPT_HEAD_CHARS + PROMPT_TAIL_CHARS) -> str:
+    if len(text) <= max_chars:
+        return text
+    marker = "\n...\n"
+    tail_chars = max_chars * PROMPT_TAIL_CHARS // (PROMPT_HEAD_CHARS + PROMPT_TAIL_CHARS)
+    return text[:max_chars - tail_chars - len(marker)] + marker + text[-tail_chars:]
+
+
+# Several chunks share one prompt: two full-size compacted chunks, or more shorter ones, which
+# together with the instructions and output still fit in num_ctx.
+LLM_BATCH_CHAR_BUDGET = 2 * (PROMPT_HEAD_CHARS + PROMPT_TAIL_CHARS)
+LLM_BATCH_MAX_CHUNKS = 4
+
+
+def _group_chunks(chunks: List[Dict]) -> List[List[Dict]]:
+    groups, group, group_chars = [], [], 0
+    for chunk in chunks:
+        chars = len(_compact_text(chunk["text"].strip()))
+        if group and (group_chars + chars > LLM_BATCH_CHAR_BUDGET or len(group) == LLM_BATCH_MAX_CHUNKS):
+            groups.append(group)
+            group, group_chars = [], 0
+        group.append(chunk)
+        group_chars += chars
+    if group:
+        groups.append(group)
+    return groups
+
+
+# Per-process state for OCR workers, populated once by _init_ocr_worker.
+_worker = {}
+
+
+def _tesserocr_kwargs(tesseract_cmd: str) -> Dict:
+    api_kwargs = {"psm": PSM.SINGLE_COLUMN, "oem": OEM.DEFAULT, "lang": "eng"}
+    tessdata_dir = os.path.join(os.path.dirname(tesseract_cmd), "tessdata")
+    if os.path.isdir(tessdata_dir):
+        api_kwargs["path"] = tessdata_dir
+    return api_kwargs
+
+
+def _init_ocr_worker(pdf_path: str, tesseract_cmd: str, dpi: int, image_dir: Optional[str]) -> None:
+    # PyMuPDF documents are not thread-safe, so each worker process opens its own copy once.
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    _worker["doc"] = fitz.open(pdf_path)
+    _worker["dpi"] = dpi
+    _worker["image_dir"] = image_dir
+    _worker["tesseract_cmd"] = tesseract_cmd
+    _worker["api"] = None
+    if PyTessBaseAPI is not None:
+        _worker["api"] = PyTessBaseAPI(**_tesserocr_kwargs(tesseract_cmd))
+
+
+def _page_result(page_num: int, text: str) -> Dict:
+    return {
+        "page": page_num,
+        "filename": f"page_{page_num:03}.png",
+        "text": text,
+        "is_blank": len(text) < MIN_PAGE_TEXT_CHARS
+    }
+
+
+def _render_page(page_index: int, dpi: int) -> fitz.Pixmap:
+    # Scans are stored sideways; render them rotated 90 degrees clockwise.
+    zoom = dpi / 72
+    return _worker["doc"][page_index].get_pixmap(matrix=fitz.Matrix(zoom, zoom).prerotate(90))
+
+
+def _render_first_pass(page_index: int) -> Optional[fitz.Pixmap]:
+    # Renders at the configured dpi (saving a debug copy if asked); None means the page is blank.
+    pix = _render_page(page_index, _worker["dpi"])
+    if _worker["image_dir"]:
+        pix.save(os.path.join(_worker["image_dir"], f"page_{page_index + 1:03}.png"))
+
+    # Blank separator sheets are near-uniform; a strided sample is enough to tell.
+    pixels = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pixels[::4, ::4].std() < BLANK_PAGE_STDDEV:
+        return None
+    return pix
+
+
+def _recognize(pix: fitz.Pixmap, dpi: int) -> str:
+    api = _worker["api"]
+    api.SetImageBytes(pix.samples, pix.width, pix.height, pix.n, pix.stride)
+    api.SetSourceResolution(dpi)
+    return api.GetUTF8Text().strip()
+
+
+def _ocr_page(page_index: int) -> Dict:
+    # tesserocr path: one resident engine per worker, one page per task.
+    page_num = page_index + 1
+    pix = _render_first_pass(page_index)
+    if pix is None:
+        return _page_result(page_num, "")
+
+    text = _recognize(pix, _worker["dpi"])
+    if len(text) < MIN_PAGE_TEXT_CHARS and _worker["dpi"] < OCR_RETRY_DPI:
+        retry_pix = _render_page(page_index, OCR_RETRY_DPI)
+        # The higher resolution is not guaranteed to read more; keep whichever pass did.
+        text = max(text, _recognize(retry_pix, OCR_RETRY_DPI), key=len)
+    return _page_result(page_num, text)
+
+
+def _tesseract_filelist(image_paths: List[str], dpi: int, out_base: str) -> List[str]:
+    # One tesseract invocation over a filelist loads the model once for the whole batch.
+    if not image_paths:
+        return []
+    filelist_path = out_base + "_filelist.txt"
+    with open(filelist_path, "w", encoding="utf-8") as f:
+        f.write("".join(path + "\n" for path in image_paths))
+
+    try:
+        subprocess.run([_worker["tesseract_cmd"], filelist_path, out_base, "--dpi", str(dpi), *OCR_CONFIG.split()],
+                       check=True, capture_output=True)
+        with open(out_base + ".txt", "r", encoding="utf-8") as f:
+            texts = f.read().split("\x0c")
+    except (OSError, subprocess.CalledProcessError):
+        texts = []
+
+    # Tesseract terminates every page with a form feed, leaving one trailing empty piece.
+    if len(texts) != len(image_paths) + 1:
+        config = f"{OCR_CONFIG} --dpi {dpi}"
+        return [pytesseract.image_to_string(path, config=config).strip() for path in image_paths]
+    return [text.strip() for text in texts[:-1]]
+
+
+def _ocr_page_batch(page_indices: List[int]) -> List[Dict]:
+    # tesseract CLI path: render this worker's pages to PNG and OCR them in one call.
+    texts = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pending = []
+        for page_index in page_indices:
+            pix = _render_first_pass(page_index)
+            if pix is None:
+                texts[page_index] = ""
+                continue
+            image_path = os.path.join(tmp_dir, f"page_{page_index + 1:03}.png")
+            pix.save(image_path)
+            pending.append((page_index, image_path))
+
+        first_pass = _tesseract_filelist([path for _, path in pending], _worker["dpi"],
+                                         os.path.join(tmp_dir, "first"))
+        texts.update((page_index, text) for (page_index, _), text in zip(pending, first_pass))
+
+        retry = [page_index for page_index, _ in pending if len(texts[page_index]) < MIN_PAGE_TEXT_CHARS]
+        if retry and _worker["dpi"] < OCR_RETRY_DPI:
+            retry_paths = []
+            for page_index in retry:
+                image_path = os.path.join(tmp_dir, f"page_{page_index + 1:03}_retry.png")
+                _render_page(page_index, OCR_RETRY_DPI).save(image_path)
+                retry_paths.append(image_path)
+            retry_texts = _tesseract_filelist(retry_paths, OCR_RETRY_DPI, os.path.join(tmp_dir, "retry"))
+            for page_index, text in zip(retry, retry_texts):
+                texts[page_index] = max(texts[page_index], text, key=len)
+
+    return [_page_result(page_index + 1, texts[page_index]) for page_index in page_indices]
+
+
+def _contiguous_runs(pages: List[int]) -> List[Tuple[int, int]]:
+    runs = []
+    for page_num in pages:
+        if runs and page_num == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], page_num)
+        else:
+            runs.append((page_num, page_num))
+    return runs
+
+
+_SANITIZE_RE = re.compile(r'[\\/*?:"<>|]')
+
+
+def sanitize_filename(name: str) -> str:
+    name = name.strip().replace(" ", "_")
+    return _SANITIZE_RE.sub("", name) or "document"
 
 
 class OilDocumentProcessor:
     def __init__(self,
                  pdf_path: str,
-                 poppler_path: str,
                  tesseract_cmd: str,
                  base_dir: str,
-                 dpi: int = 300,
-                 ollama_model: str = "phi3:mini"):
+                 dpi: int = 200,
+                 ollama_model: str = DEFAULT_OLLAMA_MODEL,
+                 save_page_images: bool = False,
+                 llm_concurrency: int = 4,
+                 llm_backend: str = "ollama",
+                 llamacpp_url: str = "http://localhost:8080",
+                 dump_per_page_txt: bool = False):
+        if llm_backend not in LLM_BACKENDS:
+            raise ValueError(f"Unknown llm_backend {llm_backend!r}, expected one of {LLM_BACKENDS}")
+
         self.pdf_path = pdf_path
-        self.poppler_path = poppler_path
         self.tesseract_cmd = tesseract_cmd
         self.dpi = dpi
         self.model_name = ollama_model
+        self.save_page_images = save_page_images
+        self.llm_concurrency = llm_concurrency
+        self.llm_backend = llm_backend
+        self.llamacpp_url = llamacpp_url.rstrip("/")
+        self.dump_per_page_txt = dump_per_page_txt
 
         self.image_dir = os.path.join(base_dir, "pages")
         self.ocr_text_dir = os.path.join(base_dir, "ocr_text")
@@ -35,8 +277,10 @@ class OilDocumentProcessor:
         self.failed_log_path = os.path.join(base_dir, "failed_chunks_log.txt")
         self.output_split_pdf_dir = os.path.join(base_dir, "split_pdfs")
 
-        os.makedirs(self.image_dir, exist_ok=True)
-        os.makedirs(self.ocr_text_dir, exist_ok=True)
+        if self.save_page_images:
+            os.makedirs(self.image_dir, exist_ok=True)
+        if self.dump_per_page_txt:
+            os.makedirs(self.ocr_text_dir, exist_ok=True)
         os.makedirs(self.output_split_pdf_dir, exist_ok=True)
         os.makedirs(os.path.dirname(self.failed_log_path), exist_ok=True)
 
@@ -44,46 +288,51 @@ class OilDocumentProcessor:
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger("OilDocumentProcessor")
 
-    def convert_pdf_to_images(self) -> None:
-        images = convert_from_path(self.pdf_path, dpi=self.dpi, poppler_path=self.poppler_path)
-        for i, image in enumerate(images):
-            filename = os.path.join(self.image_dir, f"page_{i+1:03}.png")
-            try:
-                image.save(filename, "PNG")
-                self.logger.info(f"Saved: {filename}")
-            except Exception as e:
-                self.logger.error(f"Failed to save {filename}: {e}")
-
     def perform_ocr(self) -> None:
-        ocr_results = []
-        page_files = sorted([f for f in os.listdir(self.image_dir) if f.endswith(".png")])
-
-        for fname in tqdm(page_files, desc="OCR Processing"):
-            page_num = int(fname.split("_")[1].split(".")[0])
-            image_path = os.path.join(self.image_dir, fname)
-            image = Image.open(image_path).rotate(270, expand=True)
-            config = "--psm 6 --oem 3 -l eng"
-            text = pytesseract.image_to_string(image, config=config).strip()
-
-            txt_file_path = os.path.join(self.ocr_text_dir, f"page_{page_num:03}.txt")
-            with open(txt_file_path, "w", encoding="utf-8") as f:
-                f.write(text)
-
-            ocr_results.append({
-                "page": page_num,
-                "filename": fname,
-                "text": text,
-                "is_blank": len(text) < 50
-            })
-
-        with open(self.ocr_json_path, "w", encoding="utf-8") as f:
-            json.dump(ocr_results, f, indent=2)
+        # Pages are rendered inside the workers; page images are only kept on disk when
+        # save_page_images is set.
+        with fitz.open(self.pdf_path) as doc:
+            page_count = doc.page_count
+        max_workers = max(1, min(page_count, (os.cpu_count() or 1) // TESSERACT_THREAD_LIMIT))
+        image_dir = self.image_dir if self.save_page_images else None
 
-        self.logger.info(f"OCR complete for {len(page_files)} pages")
+        ocr_results = []
+        # Spawn rather than fork: main() runs the model warm-up on a background thread, and forking
+        # while it is inside httpx could copy held locks into the workers.
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_ocr_worker,
+                                 initargs=(self.pdf_path, self.tesseract_cmd, self.dpi, image_dir)) as executor, \
+                tqdm(total=page_count, desc="OCR Processing") as progress:
+            if PyTessBaseAPI is not None:
+                futures = [executor.submit(_ocr_page, i) for i in range(page_count)]
+            else:
+                # Without tesserocr each worker OCRs an interleaved batch of pages in one tesseract call.
+                futures = [executor.submit(_ocr_page_batch, list(range(i, page_count, max_workers)))
+                           for i in range(max_workers)]
+            for future in as_completed(futures):
+                result = future.result()
+                results = result if isinstance(result, list) else [result]
+                ocr_results.extend(results)
+                progress.update(len(results))
+
+        ocr_results.sort(key=lambda x: x["page"])
+
+        # chunk_documents only reads ocr_pages.json; the per-page text files are for inspection.
+        if self.dump_per_page_txt:
+            for result in ocr_results:
+                txt_file_path = os.path.join(self.ocr_text_dir, f"page_{result['page']:03}.txt")
+                with open(txt_file_path, "w", encoding="utf-8") as f:
+                    f.write(result["text"])
+
+        with open(self.ocr_json_path, "wb") as f:
+            f.write(orjson.dumps(ocr_results, option=orjson.OPT_INDENT_2))
+
+        self.logger.info(f"OCR complete for {len(ocr_results)} pages")
 
     def chunk_documents(self) -> None:
-        with open(self.ocr_json_path, "r", encoding="utf-8") as f:
-            pages = sorted(json.load(f), key=lambda x: x["page"])
+        with open(self.ocr_json_path, "rb") as f:
+            pages = sorted(orjson.loads(f.read()), key=lambda x: x["page"])
 
         chunks = []
         i = 0
@@ -126,40 +375,44 @@ class OilDocumentProcessor:
                 else:
                     i += 1
 
-        with open(self.chunks_path, "w", encoding="utf-8") as f:
-            json.dump(chunks, f, indent=2)
+        with open(self.chunks_path, "wb") as f:
+            f.write(orjson.dumps(chunks, option=orjson.OPT_INDENT_2))
 
         self.logger.info(f"Chunking complete. Total chunks: {len(chunks)}")
 
     def extract_json(self, raw_text: str) -> Dict:
+        # Decode the first object in one pass, ignoring anything the model wrote around it.
         try:
-            match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-            return json.loads(match.group())
+            result, _ = _JSON_DECODER.raw_decode(raw_text, raw_text.index("{"))
+            return result
         except Exception as e:
             self.logger.warning(f"JSON parse error: {e}")
             return None
 
-    def parse_chunks_with_ollama(self) -> None:
-        with open(self.chunks_path, "r", encoding="utf-8") as f:
-            chunks = json.load(f)
-
-        parsed_chunks = []
-
-        for chunk in chunks:
-            text = chunk["text"].strip()
-            if len(text) < 50:
-                continue
-
-            prompt = f'''
+    def warm_up_model(self) -> None:
+        # llama-server loads its model at startup; Ollama loads lazily on the first request.
+        if self.llm_backend != "ollama":
+            return
+        try:
+            # Same options as the real requests, otherwise Ollama reloads the model with the new context size.
+            ollama.generate(model=self.model_name, prompt="", options=OLLAMA_OPTIONS, keep_alive=-1)
+            self.logger.info(f"Model loaded: {self.model_name}")
+        except Exception as e:
+            self.logger.warning(f"Model warm-up failed: {e}")
+
+    def _build_batched_prompt(self, chunks_slice: List[Dict]) -> str:
+        documents = json.dumps([{"id": i, "text": _compact_text(chunk["text"].strip())}
+                                for i, chunk in enumerate(chunks_slice, start=1)], ensure_ascii=False)
+        # Everything before "Documents:" is identical across requests, so the server can reuse
+        # its KV cache for that prefix; keep the variable document text last.
+        return f'''
 You are an intelligent document parser for oil trading documents.
 
-Analyze the following document text and extract the following fields. Respond ONLY with a valid JSON object, no explanations.
+Analyze each of the documents below and extract the following fields. Respond ONLY with a valid JSON object of the form {{"results": [...]}} holding one entry per document, with the document's "id", no explanations.
 
-Document text:
-"""{text}"""
-
-JSON format:
+JSON format of each entry:
 {{
+  "id": 1,
   "document_type": "Invoice | Bill of Lading | Certificate",
   "invoice_number": "",
   "issue_date": "",
@@ -174,41 +427,111 @@ JSON format:
   "port_of_discharge": "",
   "suggested_filename": ""
 }}
-'''
 
-            try:
-                response = ollama.chat(
-                    model=self.model_name,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                result = self.extract_json(response['message']['content'])
-                if not result:
-                    raise ValueError("Could not extract valid JSON")
+Documents:
+{documents}
+'''
 
+    async def _complete(self, client, prompt: str, n_documents: int) -> str:
+        num_predict = OLLAMA_OPTIONS["num_predict"] * n_documents
+        if self.llm_backend == "llamacpp":
+            # The OpenAI-compatible endpoint applies the model's chat template (phi3's <|user|>/<|assistant|>
+            # framing); llama-server still honours its own grammar and cache_prompt fields there, and
+            # batches concurrent requests across its --parallel slots.
+            response = await client.post(f"{self.llamacpp_url}/v1/chat/completions",
+                                         json={"messages": [{"role": "user", "content": prompt}],
+                                               "max_tokens": num_predict,
+                                               "cache_prompt": True,
+                                               "grammar": EXTRACTION_GRAMMAR})
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"]
+
+        response = await client.chat(
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            format="json",
+            options={**OLLAMA_OPTIONS, "num_predict": num_predict},
+            keep_alive=-1
+        )
+        return response['message']['content']
+
+    async def _parse_group(self, client, semaphore: asyncio.Semaphore, group: List[Dict]) -> List:
+        # Returns, for each chunk in the group, either its parsed fields or the exception it failed with.
+        try:
+            prompt = self._build_batched_prompt(group)
+            async with semaphore:
+                content = await self._complete(client, prompt, len(group))
+            response = self.extract_json(content)
+            if not response or not isinstance(response.get("results"), list):
+                raise ValueError("Could not extract valid JSON")
+        except Exception as e:
+            # A whole-batch failure (bad JSON, truncated output, HTTP error) still gets the per-chunk retry.
+            if len(group) == 1:
+                return [e]
+            results = [e] * len(group)
+        else:
+            by_id = {}
+            for entry in response["results"]:
+                if isinstance(entry, dict):
+                    by_id[str(entry.pop("id", ""))] = entry
+
+            results = []
+            for doc_id, chunk in enumerate(group, start=1):
+                result = by_id.get(str(doc_id))
+                if result is None:
+                    results.append(ValueError(f"No result returned for document {doc_id} of the batch"))
+                    continue
                 result["chunk_id"] = chunk["chunk_id"]
                 result["pages"] = chunk["pages"]
-                parsed_chunks.append(result)
-                self.logger.info(f"Parsed chunk {chunk['chunk_id']}")
-                sleep(1)
+                results.append(result)
+
+        failed = [chunk for chunk, result in zip(group, results) if isinstance(result, Exception)]
+        if failed and len(group) > 1:
+            # Retry what the batch lost one chunk at a time instead of failing it outright.
+            retried = iter(await asyncio.gather(*(self._parse_group(client, semaphore, [chunk])
+                                                  for chunk in failed)))
+            results = [next(retried)[0] if isinstance(result, Exception) else result for result in results]
+        return results
+
+    async def parse_chunks_with_ollama(self) -> None:
+        with open(self.chunks_path, "rb") as f:
+            chunks = [c for c in orjson.loads(f.read()) if len(c["text"].strip()) >= 50]
+
+        # Requests only run concurrently server-side if Ollama is started with
+        # OLLAMA_NUM_PARALLEL >= llm_concurrency (and OLLAMA_MAX_LOADED_MODELS=1),
+        # or llama-server with --parallel >= llm_concurrency.
+        if self.llm_backend == "llamacpp":
+            client = httpx.AsyncClient(timeout=None)
+        else:
+            client = ollama.AsyncClient()
+        semaphore = asyncio.Semaphore(self.llm_concurrency)
+        groups = _group_chunks(chunks)
+        try:
+            group_results = await asyncio.gather(*(self._parse_group(client, semaphore, group) for group in groups))
+        finally:
+            if isinstance(client, httpx.AsyncClient):
+                await client.aclose()
 
-            except Exception as e:
-                self.logger.error(f"Failed chunk {chunk['chunk_id']}: {e}")
+        parsed_chunks = []
+        for chunk, result in zip(chunks, (r for results in group_results for r in results)):
+            if isinstance(result, Exception):
+                self.logger.error(f"Failed chunk {chunk['chunk_id']}: {result}")
                 with open(self.failed_log_path, "a", encoding="utf-8") as log:
-                    log.write(f"Chunk {chunk['chunk_id']} failed: {e}\n\n")
+                    log.write(f"Chunk {chunk['chunk_id']} failed: {result}\n\n")
                 continue
 
-        with open(self.parsed_chunks_path, "w", encoding="utf-8") as f:
-            json.dump(parsed_chunks, f, indent=2)
+            parsed_chunks.append(result)
+            self.logger.info(f"Parsed chunk {chunk['chunk_id']}")
 
-        self.logger.info("Parsed chunks saved. Model used: " + self.model_name)
+        with open(self.parsed_chunks_path, "wb") as f:
+            f.write(orjson.dumps(parsed_chunks, option=orjson.OPT_INDENT_2))
 
-    def split_pdf_by_chunks(self) -> None:
-        def sanitize_filename(name: str) -> str:
-            name = name.strip().replace(" ", "_")
-            return re.sub(r'[\\/*?:"<>|]', "", name) or "document"
+        model_used = self.model_name if self.llm_backend == "ollama" else self.llamacpp_url
+        self.logger.info(f"Parsed chunks saved. Model used: {model_used} ({self.llm_backend})")
 
-        with open(self.parsed_chunks_path, "r", encoding="utf-8") as f:
-            parsed_chunks = json.load(f)
+    def split_pdf_by_chunks(self) -> None:
+        with open(self.parsed_chunks_path, "rb") as f:
+            parsed_chunks = orjson.loads(f.read())
 
         doc = fitz.open(self.pdf_path)
 
@@ -223,8 +546,9 @@ JSON format:
             output_path = os.path.join(self.output_split_pdf_dir, filename)
             new_doc = fitz.open()
 
-            for page_num in pages:
-                new_doc.insert_pdf(doc, from_page=page_num - 1, to_page=page_num - 1)
+            # One insert_pdf (and xref fixup) per contiguous run of pages.
+            for first, last in _contiguous_runs(pages):
+                new_doc.insert_pdf(doc, from_page=first - 1, to_page=last - 1)
 
             try:
                 new_doc.save(output_path)
@@ -241,16 +565,16 @@ JSON format:
 def main():
     processor = OilDocumentProcessor(
         pdf_path="D:/LLM/oil-invoice-splitter-llm/data/acartwright_250505-110900-58d.pdf",
-        poppler_path="C:/poppler-24.08.0/Library/bin",
         tesseract_cmd="D:/Tesseract-OCR/tesseract.exe",
         base_dir="D:/LLM/oil-invoice-splitter-llm/data",
-        ollama_model="phi3:mini"
+        ollama_model=DEFAULT_OLLAMA_MODEL
     )
 
-    processor.convert_pdf_to_images()
+    # Load the model in the background so it is resident by the time OCR finishes.
+    threading.Thread(target=processor.warm_up_model, daemon=True).start()
     processor.perform_ocr()
     processor.chunk_documents()
-    processor.parse_chunks_with_ollama()
+    asyncio.run(processor.parse_chunks_with_ollama())
     processor.split_pdf_by_chunks()
 
 